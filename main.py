@@ -1,12 +1,28 @@
 import asyncio
-import json
 import logging
+import os
 import random
-from dataclasses import dataclass
-from typing import Optional, Dict, List, Tuple
+import re
+from collections import deque, namedtuple
+from dataclasses import dataclass, field
+from typing import Deque, Optional, Dict, List, Tuple
 from uuid import uuid4
 
+import aiofiles
+import msgpack
+import orjson
+import zstandard as zstd
 from dotenv import load_dotenv
+
+load_dotenv()
+
+# The Hugging Face cache (turn detector weights) must be redirected before the plugins are imported.
+# Pointing MODEL_CACHE_DIR at a tmpfs (e.g. /dev/shm) only speeds up loading: each worker process
+# still reads its own copy of the weights into memory.
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR")
+if MODEL_CACHE_DIR:
+    os.environ.setdefault("HF_HUB_CACHE", os.path.join(MODEL_CACHE_DIR, "huggingface"))
+
 from livekit import api
 from livekit.plugins import google, deepgram, silero
 from livekit.agents import (
@@ -31,8 +47,6 @@ from livekit.plugins.turn_detector.multilingual import MultilingualModel
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("debate-ai")
 
-load_dotenv()
-
 # Common instructions for debater agents
 debater_instructions = (
     "You are a debater in a public forum debate. Your goal is to present compelling, "
@@ -51,7 +65,7 @@ DEBATE_TOPICS = [
 ]
 
 # Debate rounds and timings
-ROUNDS = [
+_RAW_ROUNDS = [
     ("constructive_a", 4 * 60, "A"),
     ("constructive_c", 4 * 60, "C"),
     ("crossfire_ac", 3 * 60, ["A", "C"]),
@@ -65,6 +79,125 @@ ROUNDS = [
     ("final_focus_d", 2 * 60, "D"),
 ]
 
+Round = namedtuple("Round", "name duration speakers is_crossfire")
+ROUNDS = tuple(Round(name, duration, speakers, isinstance(speakers, list)) for name, duration, speakers in _RAW_ROUNDS)
+ROUND_NAMES = tuple(r.name for r in ROUNDS)
+# Indices of the 3-minute rounds that are subject to the early-end penalty
+SHORT_ROUND_INDICES = frozenset(i for i, r in enumerate(ROUNDS) if r.duration == 3 * 60)
+
+class TranscriptBuffer:
+    """Collects transcript lines per (room, round) and appends them to disk in batches."""
+
+    FLUSH_INTERVAL = 0.2  # Seconds between background flushes
+    FLUSH_BYTES = 64 * 1024  # Flush a round early once this much text is pending
+
+    def __init__(self):
+        self._lines: Dict[Tuple[str, str], List[bytes]] = {}
+        self._sizes: Dict[Tuple[str, str], int] = {}
+        self._lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None  # Timed flush
+        self._overflow_task: Optional[asyncio.Task] = None  # Flush triggered by FLUSH_BYTES
+
+    def append(self, room_id: str, round_name: str, speaker: str, text: str):
+        key = (room_id, round_name)
+        line = orjson.dumps({speaker: text}) + b"\n"
+        self._lines.setdefault(key, []).append(line)
+        self._sizes[key] = self._sizes.get(key, 0) + len(line)
+        if self._sizes[key] >= self.FLUSH_BYTES and (self._overflow_task is None or self._overflow_task.done()):
+            self._overflow_task = asyncio.create_task(self.flush(room_id))
+            self._overflow_task.add_done_callback(self._on_flush_done)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+            self._flush_task.add_done_callback(self._on_flush_done)
+
+    def _on_flush_done(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Failed to write transcripts: {task.exception()}")
+        # Lines appended while the flush was writing still need a timer
+        if self._lines:
+            self._schedule_flush()
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.FLUSH_INTERVAL)
+        await self.flush()
+
+    async def flush(self, room_id: Optional[str] = None):
+        """Write pending lines for one room (or every room) as newline-delimited JSON."""
+        async with self._lock:
+            for key in [k for k in self._lines if room_id is None or k[0] == room_id]:
+                lines = self._lines.pop(key)
+                self._sizes.pop(key, None)
+                async with aiofiles.open(f"transcripts_{key[0]}_{key[1]}.ndjson", "ab", buffering=1 << 16) as f:
+                    await f.write(b"".join(lines))
+
+transcript_buffer = TranscriptBuffer()
+
+# Bounds on the transcripts kept in memory for judging
+MAX_TRANSCRIPTS_PER_SPEAKER = 64
+MAX_TRANSCRIPT_CHARS_PER_ROUND = 16 * 1024
+
+# Data channel messages are msgpack maps tagged with this version; v1 clients sent JSON
+PROTOCOL_VERSION = 2
+
+def encode_message(message: Dict) -> bytes:
+    return msgpack.packb({"v": PROTOCOL_VERSION, **message}, use_bin_type=True)
+
+# Payloads below this size are not worth compressing
+COMPRESSION_THRESHOLD = 1024
+_compressor = zstd.ZstdCompressor(level=3)
+
+def encode_compressed_message(message: Dict) -> bytes:
+    """Encode a message, wrapping it as zstd-compressed `<type>_zstd` bytes when it is large."""
+    payload = encode_message(message)
+    if len(payload) < COMPRESSION_THRESHOLD:
+        return payload
+    return encode_message({"type": f"{message['type']}_zstd", "data": _compressor.compress(payload)})
+
+def decode_message(data: bytes) -> Dict:
+    """Decode an incoming data channel message, accepting JSON from clients that predate msgpack."""
+    if data.lstrip()[:1] == b"{":
+        return orjson.loads(data)
+    return msgpack.unpackb(data, raw=False)
+
+def pack_map_prefix(fields: Dict, extra: int) -> bytes:
+    """Pack the header and leading entries of a map that will be completed with `extra` more pairs."""
+    packer = msgpack.Packer(use_bin_type=True)
+    return packer.pack_map_header(len(fields) + extra) + b"".join(
+        packer.pack(key) + packer.pack(value) for key, value in fields.items()
+    )
+
+# Set by the moderator once roles and topic are assigned for a room. This is process-local: it only
+# reaches debaters whose job runs in the same worker process as the moderator's (e.g. a thread
+# executor). With the default one-process-per-job executor, debaters still time out after 10 s.
+ROOM_READY: Dict[str, asyncio.Event] = {}
+
+def room_ready(room_id: str) -> asyncio.Event:
+    return ROOM_READY.setdefault(room_id, asyncio.Event())
+
+# Rounds with less transcript text than this are given default scores without an LLM call
+MIN_TRANSCRIPT_CHARS = 50
+
+# Debaters that are always played by agents; B is also an agent in single-user mode
+SPEAKABLE_LOCAL = frozenset({"C", "D"})
+
+def eligible_speakers(speakers, is_crossfire: bool, mode: str) -> Tuple[str, ...]:
+    """Agent-controlled debaters whose speaking is toggled for a round with these speakers."""
+    return tuple(
+        debater_id for debater_id in (speakers if is_crossfire else [speakers])
+        if debater_id in SPEAKABLE_LOCAL or (mode == "single" and debater_id == "B")
+    )
+
+ROUND_ELIGIBLE_SINGLE = tuple(eligible_speakers(r.speakers, r.is_crossfire, "single") for r in ROUNDS)
+ROUND_ELIGIBLE_MULTI = tuple(eligible_speakers(r.speakers, r.is_crossfire, "multi") for r in ROUNDS)
+
+# Seconds before the end of a round at which the state frame is rebroadcast
+STATE_CHECKPOINTS = (30, 10, 5)
+# Fields appended to the cached state frame prefix on every send
+STATE_TIMING_FIELDS = ("time_remaining", "end_time_monotonic", "server_now")
+
 @dataclass
 class DebateState:
     room_id: str  # Room identifier for multi-room support
@@ -75,21 +208,36 @@ class DebateState:
     topic: str
     scores: Dict[str, List[int]]  # e.g., {"T1": [25, 27], "T2": [26, 28]}
     prep_time: Dict[str, float]  # Remaining prep time per team (seconds)
-    transcripts: Dict[str, Dict[str, List[str]]]  # Transcripts per speaker per round
+    transcripts: Dict[str, Dict[str, Deque[str]]]  # Transcripts per speaker per round
     custom_rounds: Optional[List[Tuple[str, int, List[str]]]] = None  # Support custom formats
+    transcript_chars: Dict[str, int] = field(default_factory=dict)  # Stored transcript length per round
+
+    def add_transcript(self, round_name: str, speaker: str, text: str):
+        """Store a transcript fragment, evicting the oldest ones once the round is over budget."""
+        speakers = self.transcripts.setdefault(round_name, {})
+        texts = speakers.setdefault(speaker, deque(maxlen=MAX_TRANSCRIPTS_PER_SPEAKER))
+        chars = self.transcript_chars.get(round_name, 0) + len(text)
+        if len(texts) == texts.maxlen:
+            chars -= len(texts[0])
+        texts.append(text)
+        while chars > MAX_TRANSCRIPT_CHARS_PER_ROUND:
+            # Trim the speaker holding the most fragments so no one is silenced first
+            oldest = max(speakers.values(), key=len).popleft()
+            chars -= len(oldest)
+        self.transcript_chars[round_name] = chars
 
 class DebaterAgent(Agent):
-    def __init__(self, debater_id: str, role: str, team: str, topic: str, *, chat_ctx: Optional[ChatContext] = None):
+    def __init__(self, debater_id: str, role: str, team: str, topic: str, *, plugins: Dict, turn_detection: MultilingualModel, chat_ctx: Optional[ChatContext] = None):
         super().__init__(
             instructions=(
                 f"{debater_instructions} Your ID is {debater_id}, representing team {team} "
                 f"with role {role}. The debate topic is: {topic}. Adapt your arguments to the "
                 "current round (e.g., constructive, rebuttal, crossfire) and respond to opponents’ points."
             ),
-            llm=google.LLM(model="gemini-1.5-flash", temperature=0.8),
-            stt=deepgram.STT(model="nova-3", language="multi"),
-            tts=deepgram.TTS(model="aura-asteria-en"),
-            turn_detection=MultilingualModel(),
+            llm=plugins["llm"],
+            stt=plugins["stt"],
+            tts=plugins["tts"],
+            turn_detection=turn_detection,
             chat_ctx=chat_ctx,
         )
         self.debater_id = debater_id
@@ -113,18 +261,13 @@ class DebaterAgent(Agent):
     @function_tool
     async def receive_transcript(self, context: RunContext[DebateState], speaker: str, text: str):
         """Receive and store transcript for this debater."""
-        round_name = ROUNDS[context.userdata.round_index][0]
-        if round_name not in context.userdata.transcripts:
-            context.userdata.transcripts[round_name] = {}
-        if speaker not in context.userdata.transcripts[round_name]:
-            context.userdata.transcripts[round_name][speaker] = []
-        context.userdata.transcripts[round_name][speaker].append(text[:1000])  # Limit text length
-        # Save to file for persistence
-        with open(f"transcripts_{context.userdata.room_id}_{round_name}.json", "a") as f:
-            json.dump({speaker: text}, f, indent=2)
+        round_name = ROUND_NAMES[context.userdata.round_index]
+        context.userdata.add_transcript(round_name, speaker, text[:1000])  # Limit text length
+        # Queue for persistence; the buffer flushes to disk in the background
+        transcript_buffer.append(context.userdata.room_id, round_name, speaker, text)
 
 class ModeratorAgent(Agent):
-    def __init__(self):
+    def __init__(self, room_id: str):
         super().__init__(
             instructions=(
                 "You are the moderator of a public forum debate. Assign Pro/Con roles randomly, "
@@ -136,6 +279,8 @@ class ModeratorAgent(Agent):
             tts=deepgram.TTS(model="aura-asteria-en"),
         )
         self.debate_state = None
+        # Per-room generator: avoids the shared global one and makes a room's draw reproducible
+        self._rng = random.Random(room_id)
 
     async def on_enter(self):
         await self.initialize_debate()
@@ -143,22 +288,24 @@ class ModeratorAgent(Agent):
     async def initialize_debate(self):
         # Assign roles and topic
         roles = ["Pro", "Con"]
-        random.shuffle(roles)
+        self._rng.shuffle(roles)
         self.debate_state.roles = {"T1": roles[0], "T2": roles[1]}
-        self.debate_state.topic = random.choice(DEBATE_TOPICS)
+        self.debate_state.topic = self._rng.choice(DEBATE_TOPICS)
         self.debate_state.prep_time = {"T1": 2 * 60, "T2": 2 * 60}
         self.debate_state.round_index = 0
         self.debate_state.transcripts = {}
+        self.debate_state.transcript_chars = {}
         await self.announce(
             f"Team T1 (A, B) is {self.debate_state.roles['T1']}, "
             f"Team T2 (C, D) is {self.debate_state.roles['T2']}. "
             f"Topic: {self.debate_state.topic}"
         )
+        room_ready(self.debate_state.room_id).set()
         await self.offer_prep_time()
 
     async def announce(self, message: str):
         await self.session.room.send_data(
-            json.dumps({"type": "announcement", "message": message}).encode(),
+            encode_message({"type": "announcement", "message": message}),
             to=None
         )
         logger.info(f"Announcement: {message}")
@@ -173,71 +320,67 @@ class ModeratorAgent(Agent):
         if self.debate_state.round_index >= len(rounds):
             await self.end_debate()
             return
-        round_name, duration, speakers = rounds[self.debate_state.round_index]
+        round_name, duration, speakers = rounds[self.debate_state.round_index][:3]
         self.debate_state.time_remaining = duration
-        is_crossfire = isinstance(speakers, list)
         await self.announce(f"Starting round: {round_name.replace('_', ' ').title()}")
-        await self.session.room.send_data(
-            json.dumps({
-                "type": "state",
-                "round": round_name,
-                "speakers": speakers,
-                "time_remaining": duration
-            }).encode(),
-            to=None
+        # Only the timing fields change between state frames, so serialize the rest once
+        state_prefix = pack_map_prefix(
+            {"v": PROTOCOL_VERSION, "type": "state", "round": round_name, "speakers": speakers},
+            len(STATE_TIMING_FIELDS),
         )
+        now = asyncio.get_running_loop().time
+        end_time = now() + duration
+        # Clients interpolate time_remaining from end_time; the server only resends at checkpoints
+        await self.send_state(state_prefix, end_time)
+        # Agent-controlled debaters that speak this round; each debater filters the broadcast by its own ID
+        if self.debate_state.custom_rounds:
+            eligible_ids = eligible_speakers(speakers, isinstance(speakers, list), self.debate_state.mode)
+        elif self.debate_state.mode == "single":
+            eligible_ids = ROUND_ELIGIBLE_SINGLE[self.debate_state.round_index]
+        else:
+            eligible_ids = ROUND_ELIGIBLE_MULTI[self.debate_state.round_index]
         # Enable speaking for current speakers
-        for debater_id in (speakers if is_crossfire else [speakers]):
-            if debater_id in ["C", "D"] or (self.debate_state.mode == "single" and debater_id == "B"):
-                await self.session.room.send_data(
-                    json.dumps({"type": "set_speaking", "can_speak": True}).encode(),
-                    to=f"debater_{debater_id.lower()}"
-                )
-        # Start precise timer
-        end_time = asyncio.get_event_loop().time() + duration
-        while asyncio.get_event_loop().time() < end_time:
-            await asyncio.sleep(0.1)  # Higher resolution
-            self.debate_state.time_remaining = end_time - asyncio.get_event_loop().time()
-            await self.session.room.send_data(
-                json.dumps({
-                    "type": "state",
-                    "round": round_name,
-                    "speakers": speakers,
-                    "time_remaining": self.debate_state.time_remaining
-                }).encode(),
-                to=None
-            )
-            if self.debate_state.time_remaining <= 0:
-                break
+        await self.set_speaking(eligible_ids, True)
+        for checkpoint in STATE_CHECKPOINTS:
+            if checkpoint >= duration:
+                continue
+            await asyncio.sleep(end_time - checkpoint - now())
+            await self.send_state(state_prefix, end_time)
+        await asyncio.sleep(end_time - now())
+        self.debate_state.time_remaining = end_time - now()
         await self.announce("Time's up! Please stop speaking.")
-        if is_crossfire:
-            for debater_id in speakers:
-                if debater_id in ["C", "D"] or (self.debate_state.mode == "single" and debater_id == "B"):
-                    await self.session.room.send_data(
-                        json.dumps({"type": "set_speaking", "can_speak": False}).encode(),
-                        to=f"debater_{debater_id.lower()}"
-                    )
-        else:
-            debater_id = speakers
-            if debater_id in ["C", "D"] or (self.debate_state.mode == "single" and debater_id == "B"):
-                await self.session.room.send_data(
-                    json.dumps({"type": "set_speaking", "can_speak": False}).encode(),
-                    to=f"debater_{debater_id.lower()}"
-                )
+        await self.set_speaking(eligible_ids, False)
         # Check for short round penalty (for 3-min rounds)
         if duration == 3 * 60 and self.debate_state.time_remaining < 0:
             shortfall = abs(self.debate_state.time_remaining)
             await self.announce(f"Warning: Round ended {shortfall:.1f}s early. Points may be deducted.")
         self.debate_state.round_index += 1
         await self.session.room.send_data(
-            json.dumps({"type": "score_round"}).encode(),
+            encode_message({"type": "score_round"}),
             to="judge"
         )
 
+    async def set_speaking(self, debater_ids: Tuple[str, ...], can_speak: bool):
+        if not debater_ids:
+            return
+        await self.session.room.send_data(
+            encode_message({"type": "set_speaking", "speakers": debater_ids, "can_speak": can_speak}),
+            to=None
+        )
+
+    async def send_state(self, state_prefix: bytes, end_time: float):
+        now = asyncio.get_running_loop().time()
+        self.debate_state.time_remaining = end_time - now
+        timing = (round(self.debate_state.time_remaining, 2), end_time, now)
+        await self.session.room.send_data(
+            state_prefix + b"".join(msgpack.packb(item) for pair in zip(STATE_TIMING_FIELDS, timing) for item in pair),
+            to=None
+        )
+
     async def end_debate(self):
         await self.announce("Debate concluded. Awaiting final scores from the Judge.")
         await self.session.room.send_data(
-            json.dumps({"type": "finalize_scores"}).encode(),
+            encode_message({"type": "finalize_scores"}),
             to="judge"
         )
 
@@ -258,6 +401,44 @@ class ModeratorAgent(Agent):
         await self.announce(f"Prep time for Team {team} is over.")
         await self.start_round()
 
+# Times the judge retries an LLM call that raised
+LLM_ATTEMPTS = 3
+
+# Fallback patterns for judge responses that are not valid JSON
+SCORE_PATTERNS = {team: re.compile(rf'"{team}"\s*:\s*(\d+)') for team in ("T1", "T2")}
+EXPLANATION_PATTERN = re.compile(r'"explanation"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+def clamp_score(score) -> int:
+    return min(max(int(score), 21), 30)
+
+def parse_judge_response(text: str) -> Tuple[int, int, str]:
+    """Extract (T1 score, T2 score, explanation) from the judge LLM's reply."""
+    try:
+        result = orjson.loads(text)
+        return (
+            clamp_score(result.get("T1", 25)),
+            clamp_score(result.get("T2", 25)),
+            result.get("explanation", "No explanation provided"),
+        )
+    except (orjson.JSONDecodeError, AttributeError, TypeError, ValueError) as e:
+        logger.warning(f"Judge response is not valid JSON, falling back to pattern extraction: {e}")
+    scores = {}
+    for team, pattern in SCORE_PATTERNS.items():
+        match = pattern.search(text)
+        scores[team] = clamp_score(match.group(1)) if match else 25
+    match = EXPLANATION_PATTERN.search(text)
+    explanation = "No explanation provided"
+    if match:
+        try:
+            explanation = orjson.loads(b'"' + match.group(1).encode() + b'"')
+        except orjson.JSONDecodeError:
+            explanation = match.group(1)
+    return scores["T1"], scores["T2"], explanation
+
+async def save_results(room_id: str, feedback: Dict):
+    async with aiofiles.open(f"debate_results_{room_id}.json", "wb") as f:
+        await f.write(orjson.dumps(feedback, option=orjson.OPT_INDENT_2))
+
 class JudgeAgent(Agent):
     def __init__(self):
         super().__init__(
@@ -271,35 +452,41 @@ class JudgeAgent(Agent):
             llm=google.LLM(model="gemini-1.5-flash", temperature=0.5),
         )
         self.score_history = []
+        # Running totals so averages are available after every round without rescanning
+        self.totals = {"T1": 0, "T2": 0}
+        self.counts = 0
 
-    async def evaluate_round(self, round_name: str, transcripts: Dict[str, List[str]], state: DebateState) -> Tuple[int, int]:
-        prompt = (
+    async def judge_transcripts(self, round_name: str, transcripts: Dict[str, Deque[str]]) -> Tuple[int, int, str]:
+        header = (
             f"Evaluate the following debate round ({round_name}) based on logic, evidence, delivery, and refutation. "
             f"Assign scores from 21-30 for each team (T1: A, B; T2: C, D). Verify factual claims and adjust scores: "
             f"+1-2 for verified facts, -1-2 for incorrect facts. Provide a brief explanation.\n\n"
             f"Transcripts:\n"
         )
-        for speaker, texts in transcripts.items():
-            prompt += f"{speaker}: {' '.join(texts)}\n"
-        score_t1, score_t2, explanation = 25, 25, "Default score"
-        for attempt in range(3):  # Retry up to 3 times
+        prompt = "".join([header, *(f"{speaker}: {' '.join(texts)}\n" for speaker, texts in transcripts.items())])
+        response = None
+        for attempt in range(LLM_ATTEMPTS):  # Retry transport failures only; a bad reply is parsed as-is
             try:
                 response = await self.llm.generate(prompt)
-                result = json.loads(response.text) if response.text else {}
-                score_t1 = min(max(result.get("T1", 25), 21), 30)
-                score_t2 = min(max(result.get("T2", 25), 21), 30)
-                explanation = result.get("explanation", "No explanation provided")
                 break
-            except (json.JSONDecodeError, Exception) as e:
+            except Exception as e:
                 logger.warning(f"Attempt {attempt + 1} failed: {e}")
-                if attempt == 2:
-                    explanation = "Failed to evaluate round"
+        if response is None:
+            return 25, 25, "Failed to evaluate round"
+        return parse_judge_response(response.text or "")
+
+    async def evaluate_round(self, round_name: str, transcripts: Dict[str, Deque[str]], state: DebateState) -> Tuple[int, int]:
+        if sum(len(text) for texts in transcripts.values() for text in texts) < MIN_TRANSCRIPT_CHARS:
+            logger.info(f"Skipping evaluation of {round_name}: not enough transcript to judge")
+            score_t1, score_t2, explanation = 25, 25, "No content to evaluate"
+        else:
+            score_t1, score_t2, explanation = await self.judge_transcripts(round_name, transcripts)
         # Apply shortfall penalty for 3-min rounds
-        if ROUNDS[state.round_index][1] == 3 * 60 and state.time_remaining < 0:
+        if state.round_index in SHORT_ROUND_INDICES and state.time_remaining < 0:
             shortfall = abs(state.time_remaining) / 30  # 1 point per 30s shortfall
             score_t1 = max(21, score_t1 - int(shortfall))
             score_t2 = max(21, score_t2 - int(shortfall))
-            explanation += f" Deducted {shortfall:.1f} points for early round end."
+            explanation = f"{explanation} Deducted {shortfall:.1f} points for early round end."
         self.score_history.append({
             "round": round_name,
             "T1_score": score_t1,
@@ -308,32 +495,40 @@ class JudgeAgent(Agent):
         })
         return score_t1, score_t2
 
+    def average(self, team: str) -> float:
+        return self.totals[team] / self.counts if self.counts else 0
+
     @function_tool
     async def score_round(self, context: RunContext[DebateState]):
-        round_name = ROUNDS[context.userdata.round_index - 1][0]
+        round_name = ROUND_NAMES[context.userdata.round_index - 1]
         transcripts = context.userdata.transcripts.get(round_name, {})
         score_t1, score_t2 = await self.evaluate_round(round_name, transcripts, context.userdata)
         context.userdata.scores["T1"].append(score_t1)
         context.userdata.scores["T2"].append(score_t2)
+        self.totals["T1"] += score_t1
+        self.totals["T2"] += score_t2
+        self.counts += 1
         await self.session.room.send_data(
-            json.dumps({
+            encode_message({
                 "type": "scores",
                 "round": round_name,
                 "T1_score": score_t1,
                 "T2_score": score_t2,
+                "T1_avg_score": round(self.average("T1"), 2),
+                "T2_avg_score": round(self.average("T2"), 2),
                 "explanation": self.score_history[-1]["explanation"]
-            }).encode(),
+            }),
             to=None
         )
         await self.session.room.send_data(
-            json.dumps({"type": "continue_debate"}).encode(),
+            encode_message({"type": "continue_debate"}),
             to="moderator"
         )
 
     @function_tool
     async def finalize_scores(self, context: RunContext[DebateState]):
-        avg_t1 = sum(context.userdata.scores["T1"]) / len(context.userdata.scores["T1"]) if context.userdata.scores["T1"] else 0
-        avg_t2 = sum(context.userdata.scores["T2"]) / len(context.userdata.scores["T2"]) if context.userdata.scores["T2"] else 0
+        avg_t1 = self.average("T1")
+        avg_t2 = self.average("T2")
         winner = "T1" if avg_t1 > avg_t2 else "T2" if avg_t2 > avg_t1 else "Tie"
         feedback = {
             "winner": winner,
@@ -345,38 +540,52 @@ class JudgeAgent(Agent):
             "T2_improvements": "Enhance factual accuracy if T2 lost" if winner == "T1" else "Sustain persuasiveness",
             "score_history": self.score_history
         }
-        with open(f"debate_results_{context.userdata.room_id}.json", "w") as f:
-            json.dump(feedback, f, indent=2)
-        await self.session.room.send_data(
-            json.dumps({
-                "type": "final_results",
-                "winner": winner,
-                "T1_avg_score": round(avg_t1, 2),
-                "T2_avg_score": round(avg_t2, 2),
-                "feedback": feedback
-            }).encode(),
-            to=None
+        # Saving and broadcasting are independent; the room is only deleted once both are done
+        await asyncio.gather(
+            save_results(context.userdata.room_id, feedback),
+            self.session.room.send_data(
+                encode_compressed_message({
+                    "type": "final_results",
+                    "winner": winner,
+                    "T1_avg_score": round(avg_t1, 2),
+                    "T2_avg_score": round(avg_t2, 2),
+                    "feedback": feedback
+                }),
+                to=None
+            ),
         )
         job_ctx = get_job_context()
         await job_ctx.api.room.delete_room(api.DeleteRoomRequest(room=job_ctx.room.name))
 
 def prewarm(proc: JobProcess):
     proc.userdata["vad"] = silero.VAD.load()
+    # Shared by every session and debater this process runs, so clients are only created once.
+    # The turn detector needs a job context (for the inference executor) and is built in entrypoint.
+    proc.userdata["llm"] = google.LLM(model="gemini-1.5-flash", temperature=0.8)
+    proc.userdata["stt"] = deepgram.STT(model="nova-3", language="multi")
+    proc.userdata["tts"] = deepgram.TTS(model="aura-asteria-en")
 
 async def entrypoint(ctx: JobContext):
     await ctx.connect()
+    # Make sure buffered transcripts reach disk when the job ends
+    ctx.add_shutdown_callback(lambda: transcript_buffer.flush(ctx.room.name))
+
+    async def release_room_ready():
+        ROOM_READY.pop(ctx.room.name, None)
+
+    ctx.add_shutdown_callback(release_room_ready)
     # Safely access and parse metadata
     metadata = {}
     try:
         if hasattr(ctx.job, 'metadata') and ctx.job.metadata:
             if isinstance(ctx.job.metadata, str):
-                metadata = json.loads(ctx.job.metadata)
+                metadata = orjson.loads(ctx.job.metadata)
             elif isinstance(ctx.job.metadata, dict):
                 metadata = ctx.job.metadata
             else:
                 logger.warning(f"Unexpected metadata type: {type(ctx.job.metadata)}, value: {ctx.job.metadata}")
         logger.debug(f"Parsed metadata: {metadata}")
-    except (json.JSONDecodeError, TypeError) as e:
+    except (orjson.JSONDecodeError, TypeError) as e:
         logger.error(f"Failed to parse metadata: {e}")
         return
 
@@ -389,12 +598,14 @@ async def entrypoint(ctx: JobContext):
 
     logger.info(f"Starting agent: {agent_name}, mode: {mode}")
 
+    # One turn detector per job, shared by the session and the debater agent
+    turn_detection = MultilingualModel()
     session = AgentSession[DebateState](
         vad=ctx.proc.userdata["vad"],
-        llm=google.LLM(model="gemini-1.5-flash", temperature=0.8),
-        stt=deepgram.STT(model="nova-3", language="multi"),
-        tts=deepgram.TTS(model="aura-asteria-en"),
-        turn_detection=MultilingualModel(),
+        llm=ctx.proc.userdata["llm"],
+        stt=ctx.proc.userdata["stt"],
+        tts=ctx.proc.userdata["tts"],
+        turn_detection=turn_detection,
         userdata=DebateState(
             room_id=ctx.room.name,
             mode=mode,
@@ -410,22 +621,22 @@ async def entrypoint(ctx: JobContext):
 
     if agent_name in ["debater_c", "debater_d", "debater_b"]:
         # Wait for moderator to initialize roles and topic
-        for _ in range(10):  # Retry for 10 seconds
-            if session.userdata.roles and session.userdata.topic:
-                break
-            await asyncio.sleep(1)
+        try:
+            await asyncio.wait_for(room_ready(ctx.room.name).wait(), timeout=10)
+        except asyncio.TimeoutError:
+            pass
         if not session.userdata.roles or not session.userdata.topic:
             logger.error(f"DebateState not initialized for {agent_name}")
             return
 
     if agent_name == "debater_c":
-        agent = DebaterAgent("C", session.userdata.roles.get("T2", "Con"), "T2", session.userdata.topic)
+        agent = DebaterAgent("C", session.userdata.roles.get("T2", "Con"), "T2", session.userdata.topic, plugins=ctx.proc.userdata, turn_detection=turn_detection)
     elif agent_name == "debater_d":
-        agent = DebaterAgent("D", session.userdata.roles.get("T2", "Con"), "T2", session.userdata.topic)
+        agent = DebaterAgent("D", session.userdata.roles.get("T2", "Con"), "T2", session.userdata.topic, plugins=ctx.proc.userdata, turn_detection=turn_detection)
     elif agent_name == "debater_b" and mode == "single":
-        agent = DebaterAgent("B", session.userdata.roles.get("T1", "Pro"), "T1", session.userdata.topic)
+        agent = DebaterAgent("B", session.userdata.roles.get("T1", "Pro"), "T1", session.userdata.topic, plugins=ctx.proc.userdata, turn_detection=turn_detection)
     elif agent_name == "moderator":
-        agent = ModeratorAgent()
+        agent = ModeratorAgent(ctx.room.name)
         session.userdata = agent.debate_state  # Share state
     elif agent_name == "judge":
         agent = JudgeAgent()
@@ -437,10 +648,16 @@ async def entrypoint(ctx: JobContext):
     @session.on("data_received")
     async def on_data_received(data: bytes, participant: str):
         try:
-            message = json.loads(data.decode())
+            message = decode_message(data)
             logger.debug(f"Received data message: {message} from {participant}")
             if message["type"] == "transcript":
                 await agent.receive_transcript(session, participant, message["text"])
+            elif (
+                message["type"] == "set_speaking"
+                and isinstance(agent, DebaterAgent)
+                and agent.debater_id in message["speakers"]
+            ):
+                await agent.set_speaking(session, message["can_speak"])
             elif message["type"] == "request_prep_time" and agent_name == "moderator":
                 await agent.request_prep_time(session, message["team"])
             elif message["type"] == "continue_debate" and agent_name == "moderator":